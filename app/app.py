@@ -1,39 +1,179 @@
-from flask import Flask, render_template, request, jsonify, make_response
+# gevent的monkey patch必须在导入requests等网络库之前执行，
+# 使上游API请求的socket变为协作式调度，单个慢请求不会阻塞其他客户端
+from gevent import monkey
+monkey.patch_all()
+import gevent
+
+from flask import Flask, Response, render_template, request, make_response
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import hashlib
+import orjson
+import ijson
 from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
 from flask_cors import CORS
+from flask_caching import Cache
 import os
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import threading
 import time
 import random
+import numpy as np
 
 app = Flask(__name__, template_folder='../templates')
 CORS(app)  # 允许跨域请求
 
-# 汇率API配置 - 多个可选的API，按优先级排序
-EXCHANGE_RATE_APIS = [
+# 日志经队列交给后台线程写出，请求处理不会阻塞在stdout上
+log_queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(log_queue))
+logger.propagate = False
+
+# 汇率缓存，避免频繁请求API
+# 使用Redis作为共享缓存，所有worker进程共用同一份缓存
+CACHE_DURATION = 300  # 5分钟缓存
+STALE_CACHE_DURATION = 7 * 24 * 3600  # 最近一次成功的汇率保留7天，所有API失败时兜底
+CACHE_CONFIG = {
+    'CACHE_TYPE': os.getenv('CACHE_TYPE', 'RedisCache'),
+    'CACHE_DEFAULT_TIMEOUT': CACHE_DURATION,
+    'CACHE_REDIS_HOST': os.getenv('REDIS_HOST', 'localhost'),
+    'CACHE_REDIS_PORT': int(os.getenv('REDIS_PORT', 6379)),
+    # 不使用Redis时(如CACHE_TYPE=SimpleCache)，进程内缓存最多保留1024项，超出后自动淘汰
+    'CACHE_THRESHOLD': 1024
+}
+if 'redis' in CACHE_CONFIG['CACHE_TYPE'].lower():
+    # redis-py默认不设超时且失败后会退避重试，Redis无响应时请求会被长时间阻塞；
+    # 这里限定超时并关闭重试，失败时按缓存未命中处理
+    from redis.backoff import NoBackoff
+    from redis.retry import Retry as RedisRetry
+    CACHE_CONFIG['CACHE_OPTIONS'] = {
+        'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.5)),
+        'socket_connect_timeout': float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.5)),
+        'retry': RedisRetry(NoBackoff(), 0)
+    }
+cache = Cache(app, config={**CACHE_CONFIG, 'CACHE_KEY_PREFIX': 'fx_cache_'})
+# 兜底汇率单独存放在另一个键前缀下，/api/clear_cache清除缓存时不会删掉它
+stale_cache = Cache(app, config={
+    **CACHE_CONFIG,
+    'CACHE_DEFAULT_TIMEOUT': STALE_CACHE_DURATION,
+    'CACHE_KEY_PREFIX': 'fx_stale_'
+})
+
+def ojsonify(obj, status=200):
+    """使用orjson序列化响应，比Flask自带的jsonify更快"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), status=status, mimetype='application/json')
+
+def with_http_cache(response, etag, cache_control, weak=False):
+    """设置ETag和Cache-Control，让浏览器和CDN直接复用相同的响应
+    
+    响应体中含时间戳等不参与ETag计算的字段时应使用弱ETag(weak=True)
+    """
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def is_cacheable_response(response):
+    """只缓存成功的响应，错误响应(带状态码的元组)和带Warning头的过期兜底/模拟数据不缓存"""
+    return (
+        not isinstance(response, tuple)
+        and response.status_code == 200
+        and 'Warning' not in response.headers
+    )
+
+def stale_cache_key(base_currency, target_currency):
+    """兜底汇率的缓存键"""
+    return f"{base_currency}_{target_currency}"
+
+def save_stale_rate(base_currency, target_currency, result):
+    """保存最近一次成功的汇率；缓存不可用时只记录日志，不影响正常响应"""
+    try:
+        stale_cache.set(stale_cache_key(base_currency, target_currency), result)
+    except Exception as e:
+        logger.warning("保存兜底汇率失败 %s/%s: %s", base_currency, target_currency, e)
+
+def load_stale_rate(base_currency, target_currency):
+    """读取最近一次成功的汇率；缓存不可用时视为没有兜底数据"""
+    try:
+        return stale_cache.get(stale_cache_key(base_currency, target_currency))
+    except Exception as e:
+        logger.warning("读取兜底汇率失败 %s/%s: %s", base_currency, target_currency, e)
+        return None
+
+def extract_rates_field(data, target_currency):
+    """从形如 {"rates": {货币: 汇率}} 的响应中取出目标货币汇率"""
+    return data.get('rates', {}).get(target_currency)
+
+def make_url_builder(url_template):
+    """由URL模板生成构造函数；模板中未使用的参数会被str.format忽略"""
+    return lambda base, target: url_template.format(base=base, target=target)
+
+# 汇率API配置 - 多个可选的API，按优先级排序；build_url由url模板生成
+EXCHANGE_RATE_APIS = [dict(api, build_url=make_url_builder(api['url'])) for api in [
     {
         'name': 'ExchangeRate-API',
         'url': 'https://api.exchangerate-api.com/v4/latest/{base}',
+        'extract_rate': extract_rates_field,
         'requires_key': False,
         'rate_limit': 1500,  # 每月免费额度
-        'timeout': 10
+        'timeout': 5  # 不超过API_DEADLINE
     },
     {
         'name': 'Frankfurter',
         'url': 'https://api.frankfurter.app/latest?from={base}&to={target}',
+        'extract_rate': extract_rates_field,
         'requires_key': False,
         'rate_limit': 1000,  # 每日免费额度
-        'timeout': 10
+        'timeout': 5  # 不超过API_DEADLINE
     },
     {
         'name': 'OpenExchangeRates',
         'url': 'https://open.er-api.com/v6/latest/{base}',
+        'extract_rate': extract_rates_field,
         'requires_key': False,
         'rate_limit': 1500,  # 每月免费额度
-        'timeout': 10
+        'timeout': 5  # 不超过API_DEADLINE
     }
-]
+]]
+
+EXCHANGE_RATE_API_BY_NAME = {api['name']: api for api in EXCHANGE_RATE_APIS}
+
+# 并行请求各API时等待结果的总时长(秒)，超时或已拿到结果后其余请求直接终止
+API_DEADLINE = 6
+# 优先用USD基准汇率表换算，最多等待的秒数；超过后才并行请求各API源
+CROSS_RATE_WAIT = 1
+
+# 正在进行中的上游请求，按key合并相同的并发请求；等待者最多等待SINGLE_FLIGHT_TIMEOUT秒
+inflight_requests = {}
+inflight_lock = threading.Lock()
+SINGLE_FLIGHT_TIMEOUT = API_DEADLINE * 2
+
+# 以USD为基准的全量汇率，其他货币对均可由两个USD汇率换算得到
+USD_RATES_URL = 'https://api.exchangerate-api.com/v4/latest/USD'
+USD_RATES_CACHE_KEY = 'usd_rates'
+
+# 复用HTTP连接池，避免每次请求都重新建立TCP+TLS连接；5xx错误自动重试，
+# 读超时不重试，否则一个卡住的上游会把单次请求的耗时放大数倍
+http_session = requests.Session()
+http_session.headers.update({'Connection': 'keep-alive'})
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+))
 
 # 货币数据 - 与前端保持一致的格式
 CURRENCY_DATA = {
@@ -59,76 +199,209 @@ CURRENCY_DATA = {
     "NZD": {"name": "New Zealand Dollar", "flag": "🇳🇿"}
 }
 
-# 汇率缓存，避免频繁请求API
-exchange_rate_cache = {}
-CACHE_DURATION = 300  # 5分钟缓存
+# 货币列表是静态的，启动时预先序列化一次，请求时直接返回
+CURRENCIES_RESPONSE_BODY = orjson.dumps({
+    'success': True,
+    'currencies': CURRENCY_DATA
+})
+CURRENCIES_ETAG = hashlib.md5(CURRENCIES_RESPONSE_BODY).hexdigest()
+
+@lru_cache(maxsize=512)
+def validate_currency_pair(base_currency, target_currency):
+    """检查货币对是否受支持，返回(基准货币是否支持, 目标货币是否支持)"""
+    return base_currency in CURRENCY_DATA, target_currency in CURRENCY_DATA
 
-def get_cached_rate(base_currency, target_currency):
-    """从缓存获取汇率"""
-    cache_key = f"{base_currency}_{target_currency}"
-    if cache_key in exchange_rate_cache:
-        cached_data = exchange_rate_cache[cache_key]
-        # 检查缓存是否过期
-        if datetime.now() - cached_data['timestamp'] < timedelta(seconds=CACHE_DURATION):
-            return cached_data['rate'], cached_data['source']
-    return None, None
-
-def set_cached_rate(base_currency, target_currency, rate, source):
-    """设置汇率缓存"""
-    cache_key = f"{base_currency}_{target_currency}"
-    exchange_rate_cache[cache_key] = {
-        'rate': rate,
-        'source': source,
-        'timestamp': datetime.now()
+@lru_cache(maxsize=512)
+def build_api_url(api_name, base_currency, target_currency):
+    """构造API请求URL，按(API, 货币对)缓存，避免重复格式化"""
+    return EXCHANGE_RATE_API_BY_NAME[api_name]['build_url'](base_currency, target_currency)
+
+def fetch_rate_from_api(api_config, base_currency, target_currency):
+    """从单个API获取汇率，返回(结果, 错误信息)"""
+    try:
+        url = build_api_url(api_config['name'], base_currency, target_currency)
+        
+        response = http_session.get(url, timeout=api_config['timeout'], stream=False)
+        
+        if response.status_code != 200:
+            return None, f"{api_config['name']}: HTTP {response.status_code}"
+        
+        data = response.json()
+        
+        rate = api_config['extract_rate'](data, target_currency)
+        
+        if not rate:
+            return None, f"{api_config['name']}: 未找到汇率数据"
+        
+        logger.info("成功从 %s 获取汇率: 1 %s = %s %s", api_config['name'], base_currency, rate, target_currency)
+        return {
+            'rate': rate,
+            'date': data.get('date') or datetime.now().strftime('%Y-%m-%d'),
+            'source': api_config['name']
+        }, None
+        
+    except requests.exceptions.Timeout:
+        return None, f"{api_config['name']}: 请求超时"
+    except requests.exceptions.ConnectionError:
+        return None, f"{api_config['name']}: 连接错误"
+    except requests.exceptions.RequestException as e:
+        return None, f"{api_config['name']}: {str(e)}"
+    except json.JSONDecodeError:
+        return None, f"{api_config['name']}: 响应格式错误"
+    except Exception as e:
+        return None, f"{api_config['name']}: 未知错误 - {str(e)}"
+
+def single_flight(key, fn, *args):
+    """相同key的并发调用只执行一次fn，其余调用等待并共享同一个结果，避免缓存过期时大量请求同时打到上游；
+    等待超时或执行者被中断时，等待者得到None，与上游全部失败的处理方式一致"""
+    with inflight_lock:
+        future = inflight_requests.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            inflight_requests[key] = future
+    
+    if not is_leader:
+        try:
+            return future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+        except FuturesTimeoutError:
+            logger.warning("等待合并请求 %s 超过%s秒，按获取失败处理", key, SINGLE_FLIGHT_TIMEOUT)
+            return None
+    
+    try:
+        result = fn(*args)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        if not future.done():
+            # 执行者被gevent.Timeout、GreenletExit等BaseException中断时，同样要唤醒等待者
+            logger.warning("合并请求 %s 被中断", key)
+            future.set_result(None)
+        with inflight_lock:
+            inflight_requests.pop(key, None)
+
+def get_usd_rates():
+    """获取以USD为基准的全部汇率，一次请求即可覆盖所有支持的货币"""
+    try:
+        usd_rates = cache.get(USD_RATES_CACHE_KEY)
+    except Exception as e:
+        logger.warning("读取USD基准汇率缓存失败: %s", e)
+        usd_rates = None
+    
+    if usd_rates is not None:
+        return usd_rates
+    return single_flight(USD_RATES_CACHE_KEY, fetch_usd_rates)
+
+def fetch_usd_rates():
+    """从上游请求USD基准汇率表；成功后由执行者写入缓存，
+    写入发生在single_flight释放合并key之前，之后到达的请求直接命中缓存，不会再请求上游"""
+    try:
+        response = http_session.get(USD_RATES_URL, timeout=API_DEADLINE)
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.warning("获取USD基准汇率失败: %s", e)
+        return None
+    except json.JSONDecodeError:
+        logger.warning("获取USD基准汇率失败: 响应格式错误")
+        return None
+    
+    if not data.get('rates'):
+        return None
+    
+    usd_rates = {
+        'rates': data['rates'],
+        'date': data.get('date') or datetime.now().strftime('%Y-%m-%d'),
+        'source': 'ExchangeRate-API'
+    }
+    try:
+        cache.set(USD_RATES_CACHE_KEY, usd_rates, timeout=CACHE_DURATION)
+    except Exception as e:
+        logger.warning("写入USD基准汇率缓存失败: %s", e)
+    return usd_rates
+
+def get_cross_rate(base_currency, target_currency):
+    """通过USD基准汇率换算任意货币对，如 EUR/JPY = USD/JPY ÷ USD/EUR"""
+    usd_rates = get_usd_rates()
+    if usd_rates is None:
+        return None
+    
+    usd_to_base = 1 if base_currency == 'USD' else usd_rates['rates'].get(base_currency)
+    usd_to_target = 1 if target_currency == 'USD' else usd_rates['rates'].get(target_currency)
+    if not usd_to_base or not usd_to_target:
+        return None
+    
+    source = usd_rates['source']
+    if 'USD' not in (base_currency, target_currency):
+        source = f"{source}(经USD换算)"
+    
+    return {
+        'rate': usd_to_target / usd_to_base,
+        'date': usd_rates['date'],
+        'source': source
     }
 
 def get_exchange_rate_from_api(base_currency, target_currency):
-    """从API获取汇率数据，尝试多个API源"""
+    """获取汇率数据，同一货币对的并发请求只访问一次上游；
+    不单独缓存货币对结果，USD基准汇率表和各接口的响应缓存已经覆盖，叠加缓存只会让汇率更旧"""
+    return single_flight(f"rate_{base_currency}_{target_currency}", fetch_exchange_rate, base_currency, target_currency)
+
+def fetch_cross_rate(base_currency, target_currency):
+    """通过USD基准汇率表换算汇率，返回(结果, 错误信息)"""
+    try:
+        result = get_cross_rate(base_currency, target_currency)
+    except Exception as e:
+        return None, f"USD交叉汇率: 未知错误 - {str(e)}"
+    
+    if result is None:
+        return None, "USD交叉汇率: 无可用的USD基准汇率"
+    return result, None
+
+def fetch_exchange_rate(base_currency, target_currency):
+    """优先通过USD基准汇率表换算；汇率表不可用或未在CROSS_RATE_WAIT秒内就绪时，
+    再与各API源并行请求，返回最先成功的结果"""
     errors = []
+    deadline = time.monotonic() + API_DEADLINE
+    cross_rate = gevent.spawn(fetch_cross_rate, base_currency, target_currency)
+    cross_rate.join(timeout=CROSS_RATE_WAIT)
     
-    for api_config in EXCHANGE_RATE_APIS:
-        try:
-            if api_config['name'] == 'ExchangeRate-API':
-                url = api_config['url'].format(base=base_currency)
-            elif api_config['name'] == 'Frankfurter':
-                url = api_config['url'].format(base=base_currency, target=target_currency)
-            elif api_config['name'] == 'OpenExchangeRates':
-                url = api_config['url'].format(base=base_currency)
-            
-            response = requests.get(url, timeout=api_config['timeout'])
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if api_config['name'] == 'ExchangeRate-API':
-                    rate = data.get('rates', {}).get(target_currency)
-                elif api_config['name'] == 'Frankfurter':
-                    rate = data.get('rates', {}).get(target_currency)
-                elif api_config['name'] == 'OpenExchangeRates':
-                    rate = data.get('rates', {}).get(target_currency)
-                
-                if rate:
-                    print(f"成功从 {api_config['name']} 获取汇率: 1 {base_currency} = {rate} {target_currency}")
-                    return {
-                        'rate': rate,
-                        'date': data.get('date', datetime.now().strftime('%Y-%m-%d')),
-                        'source': api_config['name']
-                    }
-                else:
-                    errors.append(f"{api_config['name']}: 未找到汇率数据")
-            else:
-                errors.append(f"{api_config['name']}: HTTP {response.status_code}")
-                
-        except requests.exceptions.Timeout:
-            errors.append(f"{api_config['name']}: 请求超时")
-        except requests.exceptions.ConnectionError:
-            errors.append(f"{api_config['name']}: 连接错误")
-        except requests.exceptions.RequestException as e:
-            errors.append(f"{api_config['name']}: {str(e)}")
-        except json.JSONDecodeError:
-            errors.append(f"{api_config['name']}: 响应格式错误")
-        except Exception as e:
-            errors.append(f"{api_config['name']}: 未知错误 - {str(e)}")
+    racers = []
+    if cross_rate.ready():
+        result, error = cross_rate.get()
+        if result is not None:
+            save_stale_rate(base_currency, target_currency, result)
+            return result
+        errors.append(error)
+    else:
+        # 汇率表仍在获取中，继续参与竞争
+        racers.append(cross_rate)
+    
+    api_greenlets = [
+        gevent.spawn(fetch_rate_from_api, api_config, base_currency, target_currency)
+        for api_config in EXCHANGE_RATE_APIS
+    ]
+    racers += api_greenlets
+    
+    try:
+        finished = 0
+        for greenlet in gevent.iwait(racers, timeout=max(deadline - time.monotonic(), 0)):
+            finished += 1
+            result, error = greenlet.get()
+            if result is not None:
+                save_stale_rate(base_currency, target_currency, result)
+                return result
+            errors.append(error)
+        if finished < len(racers):
+            errors.append(f"所有API均未在{API_DEADLINE}秒内返回")
+    finally:
+        # 已拿到结果或超时后终止仍在进行的API请求，被中断的连接由urllib3关闭，不会占住连接池；
+        # 汇率表请求由所有货币对共享，不终止，完成后写入缓存供后续请求使用
+        gevent.killall(api_greenlets, block=False)
+    
+    logger.warning("所有汇率API获取失败 %s/%s: %s", base_currency, target_currency, "; ".join(errors))
     
     # 如果所有API都失败，返回默认汇率（用于演示）
     if base_currency == "USD" and target_currency == "CNY":
@@ -151,72 +424,73 @@ def get_historical_data_from_api(base_currency, target_currency, days=30):
         # Frankfurter API URL for historical data
         url = f"https://api.frankfurter.app/{start_date.strftime('%Y-%m-%d')}..{end_date.strftime('%Y-%m-%d')}?from={base_currency}&to={target_currency}"
         
-        print(f"正在从Frankfurter API获取历史数据: {url}")
+        logger.debug("正在从Frankfurter API获取历史数据: %s", url)
         
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
+        # 流式解析响应，逐条读取rates中的(日期, 汇率)，不必先把整个JSON载入内存
+        # Frankfurter API返回的数据格式: {"rates": {"2023-01-01": {"USD": 1.0, "EUR": 0.85}}}
+        # 返回的日期已按升序排列，无需再排序
+        with http_session.get(url, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True  # 由urllib3负责解压gzip
+            dates = []
+            rates = []
+            for date_str, day_rates in ijson.kvitems(response.raw, 'rates', use_float=True):
+                dates.append(date_str)
+                rates.append(day_rates.get(target_currency, np.nan))
         
-        data = response.json()
+        # 整个序列一次性取整，并去掉缺少目标货币汇率的日期
+        rates = np.round(np.array(rates, dtype=np.float64), 4)
+        valid = ~np.isnan(rates)
+        history = [
+            {'date': date_str, 'rate': rate, 'timestamp': f"{date_str} 12:00:00"}
+            for date_str, rate in zip(np.array(dates)[valid].tolist(), rates[valid].tolist())
+        ]
         
-        if 'rates' not in data:
-            print(f"Frankfurter API响应中没有rates字段: {data}")
+        if not history:
+            logger.warning("Frankfurter API响应中没有%s的历史数据", target_currency)
             return None
         
-        history = []
-        
-        # Frankfurter API返回的数据格式: {"2023-01-01": {"USD": 1.0, "EUR": 0.85}}
-        for date_str, rates in data['rates'].items():
-            if target_currency in rates:
-                history.append({
-                    'date': date_str,
-                    'rate': round(rates[target_currency], 4),
-                    'timestamp': f"{date_str} 12:00:00"
-                })
-        
-        # 按日期排序
-        history.sort(key=lambda x: x['date'])
-        
-        print(f"成功获取{len(history)}天的历史数据")
+        logger.info("成功获取%d天的历史数据", len(history))
         return history
         
     except requests.exceptions.RequestException as e:
-        print(f"Frankfurter API请求失败: {e}")
+        logger.warning("Frankfurter API请求失败: %s", e)
         return None
     except Exception as e:
-        print(f"获取历史数据时发生错误: {e}")
+        logger.error("获取历史数据时发生错误: %s", e)
         return None
 
 def generate_historical_data(base_currency, target_currency, days=30):
-    """获取历史汇率数据 - 优先使用真实API，失败时回退到模拟数据"""
+    """获取历史汇率数据 - 优先使用真实API，失败时回退到模拟数据，返回(历史数据, 是否为模拟数据)"""
     
     # 首先尝试从真实API获取数据
     real_history = get_historical_data_from_api(base_currency, target_currency, days)
     
     if real_history and len(real_history) > 0:
-        return real_history
+        return real_history, False
     
     # 如果真实API失败，回退到模拟数据
-    print(f"真实API获取失败，使用模拟数据 for {base_currency}/{target_currency}")
+    logger.warning("真实API获取失败，使用模拟数据 for %s/%s", base_currency, target_currency)
     
     base_rate = 6.99 if base_currency == "USD" and target_currency == "CNY" else random.uniform(0.8, 1.2)
     
-    history = []
     today = datetime.now()
+    count = max(days + 1, 0)
     
-    for i in range(days, -1, -1):
-        date = today - timedelta(days=i)
-        # 生成随机但合理的汇率变化
-        variation = (random.random() - 0.5) * 0.05
-        rate = base_rate + variation
-        base_rate = rate  # 更新基础汇率
-        
-        history.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'rate': round(rate, 4),
-            'timestamp': date.strftime('%Y-%m-%d %H:%M:%S')
-        })
+    # 一次性生成随机但合理的汇率变化，累加得到每天的汇率
+    variations = (np.random.random(count) - 0.5) * 0.05
+    rates = np.round(base_rate + np.cumsum(variations), 4).tolist()
     
-    return history
+    # 从days天前到今天的日期序列
+    dates = np.datetime_as_string(np.datetime64(today.date()) - np.arange(count - 1, -1, -1)).tolist()
+    time_part = today.strftime('%H:%M:%S')
+    
+    history = [
+        {'date': date_str, 'rate': rate, 'timestamp': f"{date_str} {time_part}"}
+        for date_str, rate in zip(dates, rates)
+    ]
+    
+    return history, True
 
 @app.route('/')
 def index():
@@ -226,56 +500,50 @@ def index():
 @app.route('/api/currencies')
 def get_currencies():
     """获取所有支持的货币列表"""
-    return jsonify({
-        'success': True,
-        'currencies': CURRENCY_DATA,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    })
+    return with_http_cache(
+        Response(CURRENCIES_RESPONSE_BODY, mimetype='application/json'),
+        CURRENCIES_ETAG,
+        'public, max-age=86400, immutable'
+    )
 
 @app.route('/api/exchange_rate')
+@cache.cached(timeout=CACHE_DURATION, query_string=True, response_filter=is_cacheable_response)
 def get_exchange_rate():
     """获取货币对汇率 - 适配Google风格前端"""
+    # 每个请求只取一次当前时间，所有字段复用
+    now = datetime.now()
+    timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
     base_currency = request.args.get('base', 'USD').upper()
     target_currency = request.args.get('target', 'CNY').upper()
     
-    if base_currency not in CURRENCY_DATA:
-        return jsonify({
+    base_supported, target_supported = validate_currency_pair(base_currency, target_currency)
+    
+    if not base_supported:
+        return ojsonify({
             'success': False,
             'error': f"不支持的基准货币: {base_currency}",
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp': timestamp
         }), 400
     
-    if target_currency not in CURRENCY_DATA:
-        return jsonify({
+    if not target_supported:
+        return ojsonify({
             'success': False,
             'error': f"不支持的目标货币: {target_currency}",
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp': timestamp
         }), 400
     
-    # 尝试从缓存获取
-    cached_rate, cached_source = get_cached_rate(base_currency, target_currency)
-    if cached_rate is not None:
-        result = {
-            "success": True,
-            "base_currency": base_currency,
-            "target_currency": target_currency,
-            "exchange_rate": cached_rate,
-            "inverse_rate": 1 / cached_rate if cached_rate != 0 else 0,
-            "base_name": CURRENCY_DATA[base_currency]["name"],
-            "target_name": CURRENCY_DATA[target_currency]["name"],
-            "last_updated": datetime.now().strftime('%Y-%m-%d'),
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "source": cached_source,
-            "cached": True
-        }
-        return jsonify(result)
-    
     # 从API获取汇率
     try:
         api_result = get_exchange_rate_from_api(base_currency, target_currency)
+        stale = False
+        
+        if api_result is None:
+            # 所有API都失败时，返回最近一次成功获取的汇率
+            api_result = load_stale_rate(base_currency, target_currency)
+            stale = api_result is not None
         
         if api_result is None:
-            return jsonify({
+            return ojsonify({
                 "success": False,
                 "error": "无法从任何汇率API获取数据",
                 "suggestions": [
@@ -283,14 +551,11 @@ def get_exchange_rate():
                     "2. 等待几分钟后重试",
                     "3. 某些API可能有请求频率限制"
                 ],
-                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                "timestamp": timestamp
             }), 503
         
         rate = api_result['rate']
         
-        # 缓存结果
-        set_cached_rate(base_currency, target_currency, rate, api_result.get('source', '未知'))
-        
         result = {
             "success": True,
             "base_currency": base_currency,
@@ -299,24 +564,33 @@ def get_exchange_rate():
             "inverse_rate": 1 / rate if rate != 0 else 0,
             "base_name": CURRENCY_DATA[base_currency]["name"],
             "target_name": CURRENCY_DATA[target_currency]["name"],
-            "last_updated": api_result.get('date', datetime.now().strftime('%Y-%m-%d')),
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "source": api_result.get('source', '未知'),
-            "cached": False
+            "last_updated": api_result.get('date') or now.strftime('%Y-%m-%d'),
+            "timestamp": timestamp,
+            "source": 'stale' if stale else api_result.get('source', '未知')
         }
-        return jsonify(result)
+        etag = hashlib.md5(f"{base_currency}{target_currency}{rate:.6f}".encode()).hexdigest()
+        
+        if stale:
+            response = with_http_cache(ojsonify(result), etag, 'max-age=30, stale-while-revalidate=300', weak=True)
+            response.headers['Warning'] = '110 - "Response is Stale"'
+            return response
+        
+        return with_http_cache(ojsonify(result), etag, f'public, max-age={CACHE_DURATION}', weak=True)
             
     except Exception as e:
-        return jsonify({
+        return ojsonify({
             "success": False,
             "error": f"服务器错误: {str(e)}",
             "details": "请稍后重试或检查网络连接",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }), 500
 
 @app.route('/api/historical')
+@cache.cached(timeout=3600, query_string=True, response_filter=is_cacheable_response)
 def get_historical_data():
     """获取历史汇率数据 - 用于图表显示"""
+    # 每个请求只取一次当前时间，所有字段复用
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     base_currency = request.args.get('base', 'USD').upper()
     target_currency = request.args.get('target', 'CNY').upper()
     days = request.args.get('days', '30')
@@ -326,31 +600,41 @@ def get_historical_data():
     except ValueError:
         days_int = 30
     
-    if base_currency not in CURRENCY_DATA:
-        return jsonify({
+    base_supported, target_supported = validate_currency_pair(base_currency, target_currency)
+    
+    if not base_supported:
+        return ojsonify({
             'success': False,
             'error': f"不支持的基准货币: {base_currency}",
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp': timestamp
         }), 400
     
-    if target_currency not in CURRENCY_DATA:
-        return jsonify({
+    if not target_supported:
+        return ojsonify({
             'success': False,
             'error': f"不支持的目标货币: {target_currency}",
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp': timestamp
         }), 400
     
     try:
         # 获取当前汇率作为基准
+        warnings = []
         current_rate_data = get_exchange_rate_from_api(base_currency, target_currency)
         if current_rate_data is None:
-            # 使用默认汇率
+            # 所有API都失败时先用最近一次成功的汇率，仍没有才用默认汇率
+            current_rate_data = load_stale_rate(base_currency, target_currency)
+            if current_rate_data is not None:
+                warnings.append('110 - "Response is Stale"')
+        if current_rate_data is None:
             base_rate = 6.99 if base_currency == "USD" and target_currency == "CNY" else 1.0
+            warnings.append('199 - "Estimated current rate"')
         else:
             base_rate = current_rate_data['rate']
         
         # 生成历史数据
-        history = generate_historical_data(base_currency, target_currency, days_int)
+        history, simulated = generate_historical_data(base_currency, target_currency, days_int)
+        if simulated:
+            warnings.append('199 - "Simulated historical data"')
         
         result = {
             "success": True,
@@ -359,38 +643,49 @@ def get_historical_data():
             "current_rate": base_rate,
             "historical_data": history,
             "days": days_int,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }
         
-        return jsonify(result)
+        etag = hashlib.md5(orjson.dumps([base_currency, target_currency, base_rate, history])).hexdigest()
+        if warnings:
+            # 过期/默认汇率或随机生成的模拟数据，标记后不进入共享缓存，也不允许浏览器和CDN缓存
+            response = with_http_cache(ojsonify(result), etag, 'no-store', weak=True)
+            for warning in warnings:
+                response.headers.add('Warning', warning)
+            return response
+        
+        return with_http_cache(ojsonify(result), etag, 'public, max-age=3600', weak=True)
         
     except Exception as e:
-        return jsonify({
+        return ojsonify({
             "success": False,
             "error": f"获取历史数据失败: {str(e)}",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }), 500
 
 @app.route('/api/convert')
+@cache.cached(timeout=CACHE_DURATION, query_string=True, response_filter=is_cacheable_response)
 def convert_amount():
     """转换货币金额"""
+    # 每个请求只取一次当前时间，所有字段复用
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     base_currency = request.args.get('base', 'USD').upper()
     target_currency = request.args.get('target', 'CNY').upper()
     
     try:
         amount = float(request.args.get('amount', 1.0))
     except ValueError:
-        return jsonify({
+        return ojsonify({
             "success": False,
             "error": "金额必须为数字",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }), 400
     
     if amount <= 0:
-        return jsonify({
+        return ojsonify({
             "success": False,
             "error": "金额必须大于0",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }), 400
     
     # 获取汇率
@@ -398,10 +693,10 @@ def convert_amount():
         api_result = get_exchange_rate_from_api(base_currency, target_currency)
         
         if not api_result:
-            return jsonify({
+            return ojsonify({
                 "success": False,
                 "error": "无法获取汇率数据",
-                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                "timestamp": timestamp
             }), 503
         
         rate = api_result['rate']
@@ -418,45 +713,61 @@ def convert_amount():
             "target_name": CURRENCY_DATA[target_currency]["name"],
             "formatted": f"{amount:,.2f} {base_currency} = {converted_amount:,.2f} {target_currency}",
             "source": api_result.get('source', '未知'),
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }
         
-        return jsonify(result)
+        return ojsonify(result)
         
     except Exception as e:
-        return jsonify({
+        return ojsonify({
             "success": False,
             "error": f"转换失败: {str(e)}",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": timestamp
         }), 500
 
 @app.route('/api/health')
 def health_check():
     """健康检查端点"""
-    return jsonify({
+    return ojsonify({
         "status": "healthy",
         "service": "Exchange Rate API",
         "version": "2.0",
         "timestamp": datetime.now().isoformat(),
         "supported_currencies": len(CURRENCY_DATA),
-        "cache_size": len(exchange_rate_cache),
+        "cache_type": cache.config['CACHE_TYPE'],
         "active_apis": [api['name'] for api in EXCHANGE_RATE_APIS]
     })
 
 @app.route('/api/clear_cache')
 def clear_cache():
-    """清除汇率缓存"""
-    exchange_rate_cache.clear()
-    return jsonify({
+    """清除汇率缓存（包括已缓存的接口响应），兜底用的最近一次成功汇率会保留"""
+    try:
+        cache.clear()
+    except Exception as e:
+        logger.warning("清除汇率缓存失败: %s", e)
+        return ojsonify({
+            "success": False,
+            "error": "缓存服务不可用，清除失败",
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }), 503
+    
+    return ojsonify({
         "success": True,
         "message": "汇率缓存已清除",
         "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
 
+@app.after_request
+def handle_conditional_request(response):
+    """客户端携带的If-None-Match与ETag一致时返回304，无需重新传输响应体"""
+    if response.status_code == 200 and 'ETag' in response.headers:
+        response.make_conditional(request)
+    return response
+
 @app.errorhandler(404)
 def not_found(error):
     """处理404错误"""
-    return jsonify({
+    return ojsonify({
         "success": False,
         "error": "请求的资源不存在",
         "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -465,7 +776,7 @@ def not_found(error):
 @app.errorhandler(500)
 def internal_error(error):
     """处理500错误"""
-    return jsonify({
+    return ojsonify({
         "success": False,
         "error": "服务器内部错误",
         "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -501,4 +812,10 @@ if __name__ == '__main__':
     print("访问地址: http://127.0.0.1:5000")
     print("=" * 60)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # 设置FLASK_DEV时使用Flask开发服务器(支持调试和自动重载)，
+    # 否则使用gevent的WSGI服务器；生产环境请使用 gunicorn -c gunicorn.conf.py
+    if os.getenv('FLASK_DEV'):
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    else:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', 5000), app).serve_forever()
@@ -0,0 +1,17 @@
+# gunicorn生产环境配置
+# 启动方式: gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+
+# 应用位于app/app.py
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app')
+wsgi_app = 'app:app'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# 汇率服务以等待上游API为主(I/O密集)，使用gevent协程worker，
+# 每个worker可同时处理大量并发连接
+worker_class = 'gevent'
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2))
+worker_connections = 1000
+keepalive = 30